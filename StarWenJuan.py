@@ -1,3 +1,5 @@
+import asyncio
+import hashlib
 import logging
 import random
 import re
@@ -5,12 +7,14 @@ import threading
 import traceback
 from threading import Thread
 import time
-from typing import List
+from typing import Callable, List
 import json
 import os
 import requests
+import httpx
 
 from playwright.sync_api import sync_playwright, Page, Browser
+from playwright.sync_api import Error as PlaywrightError
 from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
 import openai
 
@@ -25,6 +29,12 @@ logger = logging.getLogger(__name__)
 # 代理配置（将从配置文件加载）
 proxy_config = None
 
+# 预编译清理AI回复用的正则，避免热路径上的重复编译
+_RE_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+_RE_THINK_OPEN = re.compile(r"<think>.*", re.DOTALL)
+_RE_THINK_CLOSE = re.compile(r"</think>")
+_RE_BLANK = re.compile(r"\n\s*\n")
+
 
 def scan_config_files():
     """扫描config目录中的json配置文件"""
@@ -88,35 +98,257 @@ def load_config():
             logger.warning("请输入一个有效的数字！")
 
 
-# 加载配置
-config = load_config()
-openai_config = config["openai"]
-generation_params = config["generation_params"]
-submission_params = config["submission_params"]
-
-# 加载代理配置
-proxy_config = config.get(
-    "proxy_config",
-    {
-        "enabled": False,
-        "clash_control_url": "",
-        "clash_secret": "",
-        "clash_proxy_url": "",
-        "switch_delay": 3,
-        "auto_switch": True,
-    },
-)
+# 配置与客户端由init_runtime()初始化：import本模块不再触发交互式配置选择，
+# 也不会重复创建HTTP连接池
+config = None
+openai_config = None
+generation_params = None
+submission_params = None
+client = None
+async_client = None
+http_client = None
+async_http_client = None
+max_concurrent = 5
+limiter = None
+current_persona = None
 
-logger.info("StarWenJuan自动填写工具")
-logger.info("每次填写前会生成不同的人设，然后基于人设来回答问题")
-logger.info(f"使用模型: {openai_config['model']}")
-logger.info(f"API地址: {openai_config['base_url']}")
 
-# OpenAI客户端
-client = openai.OpenAI(
-    base_url=openai_config["base_url"], api_key=openai_config["api_key"]
-)
-current_persona = None
+def init_runtime():
+    """加载配置并创建共享的HTTP/OpenAI客户端，作为脚本运行时调用一次"""
+    global config, openai_config, generation_params, submission_params, proxy_config
+    global client, async_client, http_client, async_http_client
+    global max_concurrent, limiter
+
+    config = load_config()
+    openai_config = config["openai"]
+    generation_params = config["generation_params"]
+    submission_params = config["submission_params"]
+
+    # 加载代理配置
+    proxy_config = config.get(
+        "proxy_config",
+        {
+            "enabled": False,
+            "clash_control_url": "",
+            "clash_secret": "",
+            "clash_proxy_url": "",
+            "switch_delay": 3,
+            "auto_switch": True,
+        },
+    )
+
+    # 共享连接池并启用HTTP/2多路复用，并发调用复用同一批TLS连接
+    limits = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    http_client = httpx.Client(http2=True, limits=limits)
+    async_http_client = httpx.AsyncClient(http2=True, limits=limits)
+
+    # OpenAI客户端（同步客户端用于人设生成和连接测试，异步客户端用于并发提问）
+    client = openai.OpenAI(
+        base_url=openai_config["base_url"],
+        api_key=openai_config["api_key"],
+        http_client=http_client,
+    )
+    async_client = openai.AsyncOpenAI(
+        base_url=openai_config["base_url"],
+        api_key=openai_config["api_key"],
+        http_client=async_http_client,
+    )
+    max_concurrent = generation_params.get("max_concurrent", 5)
+
+    limiter = RateLimiter(
+        openai_config.get("requests_per_minute", 60),
+        openai_config.get("tokens_per_minute", 90000),
+    )
+
+    load_answer_cache()
+
+
+# 所有AI协程都提交到同一个常驻后台事件循环：共享的AsyncClient连接池
+# 只绑定这一个循环，不会出现keep-alive连接跨已关闭循环复用的问题
+_ai_loop = None
+_ai_loop_lock = threading.Lock()
+
+# 并发信号量在常驻循环内惰性创建一次，随循环存续
+_semaphore = None
+
+
+def _get_ai_loop():
+    """获取（必要时启动）常驻的AI事件循环"""
+    global _ai_loop
+    with _ai_loop_lock:
+        if _ai_loop is None:
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, daemon=True).start()
+            _ai_loop = loop
+    return _ai_loop
+
+
+def _get_semaphore():
+    """获取常驻事件循环上的并发信号量（仅在该循环内调用）"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(max_concurrent)
+    return _semaphore
+
+
+def run_ai_tasks(tasks):
+    """把多个提问协程提交到常驻事件循环并发执行，按原顺序返回结果"""
+
+    async def _runner():
+        return await asyncio.gather(*tasks)
+
+    return asyncio.run_coroutine_threadsafe(_runner(), _get_ai_loop()).result()
+
+
+class RateLimiter:
+    """客户端侧RPM/TPM令牌桶，在发请求前主动限速，避免撞到429再退避"""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+
+    def _try_acquire(self, est_tokens):
+        # 消耗量按桶容量封顶，否则超大估算值永远等不到足够额度而死等
+        est_tokens = min(est_tokens, float(self.tpm))
+        request_cost = min(1.0, float(self.rpm))
+        with self._lock:
+            self._refill()
+            if self._requests >= request_cost and self._tokens >= est_tokens:
+                self._requests -= request_cost
+                self._tokens -= est_tokens
+                return True
+        return False
+
+    def acquire(self, est_tokens):
+        """阻塞直到桶里有1个请求额度和est_tokens个token额度"""
+        while not self._try_acquire(est_tokens):
+            time.sleep(0.05)
+
+    async def acquire_async(self, est_tokens):
+        """acquire的协程版本，等待时不阻塞事件循环"""
+        while not self._try_acquire(est_tokens):
+            await asyncio.sleep(0.05)
+
+    def update_from_headers(self, headers):
+        """根据响应头中的剩余额度校正桶，贴近服务端的真实上限"""
+        with self._lock:
+            remaining = headers.get("x-ratelimit-remaining-requests")
+            if remaining is not None:
+                try:
+                    self._requests = min(self._requests, float(remaining))
+                except ValueError:
+                    pass
+            remaining = headers.get("x-ratelimit-remaining-tokens")
+            if remaining is not None:
+                try:
+                    self._tokens = min(self._tokens, float(remaining))
+                except ValueError:
+                    pass
+
+
+# 各题型的回复token上限：答案都很短，限制解码长度能同时降低延迟和TPM消耗
+MAX_TOKENS = {
+    "single": 8,
+    "scale": 8,
+    "matrix": 8,
+    "dropdown": 8,
+    "multiple": 32,
+    "numeric_matrix": 48,
+    "text": 150,
+}
+PERSONA_MAX_TOKENS = 300
+
+# 系统提示词保持字节级稳定：人设拼在system消息末尾，
+# 这样相同人设下所有提问共享同一前缀，可命中服务端的KV前缀缓存
+ANSWER_SYSTEM_PROMPT = "你是一个问卷填写助手，根据给定人设来回答问题。回答要简洁准确，符合人设特点。直接给出答案，不要使用<think>标签进行思考。"
+
+# user消息只含题目和选项，字段顺序固定
+ANSWER_PROMPTS = {
+    "single": "请回答单选题。\n问题：{question}\n选项：{options}\n请直接返回选项编号(如：1)，不要解释。",
+    "multiple": "请回答多选题。\n问题：{question}\n选项：{options}\n请返回所选选项编号，用逗号分隔(如：1,3,5)，不要解释。",
+    "text": "请回答填空题。\n问题：{question}\n请提供一个简短、真实的答案，不要解释。字数不超过100字，不要使用emoji表情",
+    "scale": "请回答量表题。\n问题：{question}\n选项：{options}\n请直接返回选项编号(如：3)，不要解释。",
+    "matrix": "请回答矩阵题的一行。\n问题：{question}\n选项：{options}\n请直接返回选项编号(如：2)，不要解释。",
+    "matrix_batch": "请回答矩阵题的所有行。\n问题：{question}\n选项：{options}\n请只返回一个JSON整数数组，按行的顺序给出每行所选的选项编号(如：[2,3,2])，不要解释。",
+    "dropdown": "请回答下拉框题。\n问题：{question}\n选项：{options}\n请直接返回选项编号(如：2)，不要解释。",
+    "numeric_matrix": "请回答数字矩阵题。\n问题：{question}\n选项：{options}\n请为每个选项分配一个0-10的数字（不可以是小数，要保证这几个数字加起来等于10），表示比例或程度，用逗号分隔，不要解释。",
+}
+
+
+def answer_system_prompt(persona):
+    """拼接带人设的system消息，保持前缀字节稳定"""
+    return ANSWER_SYSTEM_PROMPT + "\n\n人设：" + persona
+
+
+def estimate_tokens(prompt, max_tokens=512):
+    """粗略估算一次调用消耗的token数（提示词+回复预算）"""
+    return len(prompt) // 3 + max_tokens
+
+
+# 答案缓存：同一人设下内容相同的题目不再重复请求AI（填空题除外，保留多样性）
+ANSWER_CACHE_FILE = os.path.join("cache", "answers.jsonl")
+ANSWER_CACHE_MAXSIZE = 4096
+_answer_cache = {}
+_answer_cache_lock = threading.Lock()
+
+
+def answer_cache_key(persona, question_type, question_text, options):
+    """由人设指纹和题目内容生成缓存键"""
+    persona_hash = hashlib.blake2b(
+        persona.encode("utf-8"), digest_size=8
+    ).hexdigest()
+    raw = "\x1f".join((persona_hash, question_type, question_text, str(options)))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def load_answer_cache():
+    """启动时从磁盘加载历史答案缓存"""
+    if not os.path.exists(ANSWER_CACHE_FILE):
+        return
+    try:
+        with open(ANSWER_CACHE_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                _answer_cache[entry["key"]] = entry["answer"]
+        logger.info(f"已加载 {len(_answer_cache)} 条答案缓存")
+    except Exception as e:
+        logger.warning(f"加载答案缓存失败: {e}")
+
+
+def get_cached_answer(key):
+    with _answer_cache_lock:
+        return _answer_cache.get(key)
+
+
+def store_cached_answer(key, answer):
+    with _answer_cache_lock:
+        if key in _answer_cache:
+            return
+        if len(_answer_cache) >= ANSWER_CACHE_MAXSIZE:
+            _answer_cache.pop(next(iter(_answer_cache)))
+        _answer_cache[key] = answer
+    try:
+        os.makedirs(os.path.dirname(ANSWER_CACHE_FILE), exist_ok=True)
+        with open(ANSWER_CACHE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"key": key, "answer": answer}, ensure_ascii=False))
+            f.write("\n")
+    except Exception as e:
+        logger.warning(f"写入答案缓存失败: {e}")
+
 
 
 def get_clash_proxies():
@@ -236,10 +468,10 @@ def clean_response(response_text):
         logger.warning("AI只输出了思考过程，没有实际答案")
         return ""
 
-    cleaned = re.sub(r"<think>.*?</think>", "", response_text, flags=re.DOTALL)
-    cleaned = re.sub(r"<think>.*", "", cleaned, flags=re.DOTALL)
-    cleaned = re.sub(r"</think>", "", cleaned)
-    cleaned = re.sub(r"\n\s*\n", "\n", cleaned.strip())
+    cleaned = _RE_THINK_BLOCK.sub("", response_text)
+    cleaned = _RE_THINK_OPEN.sub("", cleaned)
+    cleaned = _RE_THINK_CLOSE.sub("", cleaned)
+    cleaned = _RE_BLANK.sub("\n", cleaned.strip())
 
     return cleaned.strip()
 
@@ -250,18 +482,20 @@ def generate_persona():
     for attempt in range(max_retries):
         try:
             logger.info(f"正在生成人设... (尝试 {attempt + 1}/{max_retries})")
-            response = client.chat.completions.create(
+            system_prompt = "你是一个人设生成器。请生成一个详细的虚拟人物角色，包括年龄、性别、职业、教育背景、兴趣爱好、性格特点、生活状态等。用中文回答，保持简洁但具体。（生成的人物人设不要太过夸张，普通大学生即可）直接给出人设描述，不要使用<think>标签。"
+            limiter.acquire(estimate_tokens(system_prompt, PERSONA_MAX_TOKENS))
+            raw_response = client.chat.completions.with_raw_response.create(
                 model=openai_config["model"],
                 messages=[
-                    {
-                        "role": "system",
-                        "content": "你是一个人设生成器。请生成一个详细的虚拟人物角色，包括年龄、性别、职业、教育背景、兴趣爱好、性格特点、生活状态等。用中文回答，保持简洁但具体。（生成的人物人设不要太过夸张，普通大学生即可）直接给出人设描述，不要使用<think>标签。",
-                    },
+                    {"role": "system", "content": system_prompt},
                     {"role": "user", "content": "请生成一个完整的人物人设"},
                 ],
                 temperature=generation_params["persona_temperature"],
+                max_tokens=PERSONA_MAX_TOKENS,
                 timeout=openai_config["timeout"],
             )
+            limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
 
             persona = response.choices[0].message.content.strip()
             persona = clean_response(persona)
@@ -281,40 +515,150 @@ def generate_persona():
             time.sleep(generation_params["retry_delay"])
 
 
-def ask_ai_for_answer(question_text, options, question_type, persona):
-    """向AI询问如何回答问题"""
+# 人设池：一次批量生成后持久化复用，避免每份问卷都多一次LLM往返
+PERSONA_CACHE_FILE = os.path.join("cache", "personas.json")
+PERSONAS = []
+
+
+# 每次批量调用生成的人设数量：10个约需3000 token的回复，
+# 不会超出一般OpenAI兼容接口的单次completion上限
+PERSONA_POOL_CHUNK = 10
+
+
+def _generate_persona_chunk(n):
+    """一次批量调用生成n个人设，多次失败时返回空列表"""
     max_retries = generation_params["max_retries"]
+    prompt = (
+        f"请生成{n}个不同的虚拟人物人设，每个包括年龄、性别、职业、教育背景、"
+        "兴趣爱好、性格特点、生活状态等，保持简洁但具体（不要太过夸张，普通大学生即可）。"
+        "只返回一个JSON字符串数组，每个元素是一个完整的人设描述，不要解释。"
+    )
     for attempt in range(max_retries):
         try:
-            if question_type == "single":
-                prompt = f"根据以下人设回答单选题。人设：{persona}\n\n问题：{question_text}\n选项：{options}\n请直接返回选项编号(如：1)，不要解释。"
-            elif question_type == "multiple":
-                prompt = f"根据以下人设回答多选题。人设：{persona}\n\n问题：{question_text}\n选项：{options}\n请返回所选选项编号，用逗号分隔(如：1,3,5)，不要解释。"
-            elif question_type == "text":
-                prompt = f"根据以下人设回答填空题。人设：{persona}\n\n问题：{question_text}\n请提供一个简短、真实的答案，不要解释。字数不超过100字，不要使用emoji表情"
-            elif question_type == "scale":
-                prompt = f"根据以下人设回答量表题。人设：{persona}\n\n问题：{question_text}\n选项：{options}\n请直接返回选项编号(如：3)，不要解释。"
-            elif question_type == "matrix":
-                prompt = f"根据以下人设回答矩阵题的一行。人设：{persona}\n\n问题：{question_text}\n选项：{options}\n请直接返回选项编号(如：2)，不要解释。"
-            elif question_type == "dropdown":
-                prompt = f"根据以下人设回答下拉框题。人设：{persona}\n\n问题：{question_text}\n选项：{options}\n请直接返回选项编号(如：2)，不要解释。"
-            elif question_type == "numeric_matrix":
-                prompt = f"根据以下人设回答数字矩阵题。人设：{persona}\n\n问题：{question_text}\n选项：{options}\n请为每个选项分配一个0-10的数字（不可以是小数，要保证这几个数字加起来等于10），表示比例或程度，用逗号分隔，不要解释。"
-            else:
-                return "1"
-
-            response = client.chat.completions.create(
+            chunk_max_tokens = PERSONA_MAX_TOKENS * n
+            limiter.acquire(estimate_tokens(prompt, chunk_max_tokens))
+            raw_response = client.chat.completions.with_raw_response.create(
                 model=openai_config["model"],
                 messages=[
                     {
                         "role": "system",
-                        "content": "你是一个问卷填写助手，根据给定人设来回答问题。回答要简洁准确，符合人设特点。直接给出答案，不要使用<think>标签进行思考。",
+                        "content": "你是一个人设生成器。直接给出结果，不要使用<think>标签。",
                     },
                     {"role": "user", "content": prompt},
                 ],
-                temperature=generation_params["answer_temperature"],
+                temperature=generation_params["persona_temperature"],
+                max_tokens=chunk_max_tokens,
                 timeout=openai_config["timeout"],
             )
+            limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
+
+            content = strip_code_fences(
+                clean_response(response.choices[0].message.content.strip())
+            )
+            personas = json.loads(content)
+            if isinstance(personas, list):
+                personas = [
+                    str(p).strip() for p in personas if len(str(p).strip()) >= 20
+                ]
+                if personas:
+                    return personas
+
+            logger.warning(
+                f"人设池格式错误，重试... (尝试 {attempt + 1}/{max_retries})"
+            )
+        except Exception as e:
+            logger.error(f"批量生成人设失败 (尝试 {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                time.sleep(generation_params["retry_delay"])
+    return []
+
+
+def generate_persona_pool(n):
+    """分批批量生成n个人设，失败时退回逐个生成少量人设"""
+    personas = []
+    while len(personas) < n:
+        chunk = min(PERSONA_POOL_CHUNK, n - len(personas))
+        logger.info(f"正在批量生成人设... ({len(personas)}/{n})")
+        batch = _generate_persona_chunk(chunk)
+        if not batch:
+            break
+        personas.extend(batch)
+
+    if personas:
+        logger.info(f"批量生成了 {len(personas)} 个人设")
+        return personas[:n]
+
+    logger.warning("批量生成人设多次失败，退回逐个生成")
+    return [generate_persona() for _ in range(min(n, 5))]
+
+
+def load_or_generate_personas(n=None):
+    """加载磁盘上的人设池，没有时批量生成并写入磁盘"""
+    if n is None:
+        n = generation_params.get("persona_pool_size", 100)
+
+    if os.path.exists(PERSONA_CACHE_FILE):
+        try:
+            with open(PERSONA_CACHE_FILE, "r", encoding="utf-8") as f:
+                personas = json.load(f)
+            if isinstance(personas, list) and personas:
+                logger.info(f"已从缓存加载 {len(personas)} 个人设")
+                return personas
+        except Exception as e:
+            logger.warning(f"加载人设缓存失败: {e}")
+
+    personas = generate_persona_pool(n)
+    try:
+        os.makedirs(os.path.dirname(PERSONA_CACHE_FILE), exist_ok=True)
+        with open(PERSONA_CACHE_FILE, "w", encoding="utf-8") as f:
+            json.dump(personas, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        logger.warning(f"写入人设缓存失败: {e}")
+    return personas
+
+
+async def ask_ai_for_answer(
+    question_text, options, question_type, persona, max_tokens=None
+):
+    """向AI询问如何回答问题（并发调用，信号量限制在途请求数）"""
+    # text答案不复用；matrix_batch由matrix()在解析通过后自行缓存，
+    # 避免把截断或格式错误的数组永久写进磁盘缓存
+    cache_key = None
+    if question_type not in ("text", "matrix_batch"):
+        cache_key = answer_cache_key(persona, question_type, question_text, options)
+        cached = get_cached_answer(cache_key)
+        if cached is not None:
+            return cached
+
+    template = ANSWER_PROMPTS.get(question_type)
+    if template is None:
+        return "1"
+    prompt = template.format(question=question_text, options=options)
+
+    if max_tokens is None:
+        max_tokens = MAX_TOKENS.get(question_type, 150)
+
+    max_retries = generation_params["max_retries"]
+    for attempt in range(max_retries):
+        try:
+            async with _get_semaphore():
+                await limiter.acquire_async(estimate_tokens(prompt, max_tokens))
+                raw_response = await async_client.chat.completions.with_raw_response.create(
+                    model=openai_config["model"],
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": answer_system_prompt(persona),
+                        },
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=generation_params["answer_temperature"],
+                    max_tokens=max_tokens,
+                    timeout=openai_config["timeout"],
+                )
+                limiter.update_from_headers(raw_response.headers)
+                response = raw_response.parse()
 
             answer = response.choices[0].message.content.strip()
             answer = clean_response(answer)
@@ -332,12 +676,14 @@ def ask_ai_for_answer(question_text, options, question_type, persona):
                     )
                     continue
 
+            if cache_key is not None:
+                store_cached_answer(cache_key, answer)
             return answer
 
         except Exception as e:
             logger.error(f"AI回答失败 (尝试 {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:
-                time.sleep(generation_params["retry_delay"])
+                await asyncio.sleep(generation_params["retry_delay"])
 
     logger.warning("AI回答多次失败，使用默认答案")
     if question_type == "multiple":
@@ -348,19 +694,30 @@ def ask_ai_for_answer(question_text, options, question_type, persona):
         return "1"
 
 
+def ask_ai_for_answer_sync(
+    question_text, options, question_type, persona, max_tokens=None
+):
+    """单题路径的同步封装"""
+    return asyncio.run_coroutine_threadsafe(
+        ask_ai_for_answer(question_text, options, question_type, persona, max_tokens),
+        _get_ai_loop(),
+    ).result()
+
+
 def detect(page: Page) -> List[int]:
-    q_list: List[int] = []
-    page_num = len(page.query_selector_all('//*[@id="divQuestion"]/fieldset'))
-    for i in range(1, page_num + 1):
-        questions = page.query_selector_all(f'//*[@id="fieldset{i}"]/div')
-        valid_count = sum(
-            1
-            for question in questions
-            if question.get_attribute("topic")
-            and question.get_attribute("topic").isdigit()
-        )
-        q_list.append(valid_count)
-    return q_list
+    """统计每页有效题目数，一次evaluate完成，避免逐fieldset往返"""
+    return page.evaluate(
+        """() => {
+            const fieldsets = document.querySelectorAll('#divQuestion fieldset');
+            return Array.from(fieldsets).map((fs, i) =>
+                Array.from(document.querySelectorAll('#fieldset' + (i + 1) + ' > div'))
+                    .filter(q => {
+                        const topic = q.getAttribute('topic');
+                        return topic && /^\\d+$/.test(topic);
+                    }).length
+            );
+        }"""
+    )
 
 
 def get_question_text(page: Page, current):
@@ -370,246 +727,642 @@ def get_question_text(page: Page, current):
         if question_elem:
             return question_elem.text_content().strip()
         return f"第{current}题"
-    except:
+    except PlaywrightError:
         return f"第{current}题"
 
 
-def get_options_text(page: Page, xpath):
-    """获取选项文本"""
+def fetch_options(page: Page, xpath):
+    """一次evaluate同时取回选项数量和格式化文本，避免两次查询"""
     try:
-        options = page.query_selector_all(xpath)
-        option_texts = []
-        for i, option in enumerate(options, 1):
-            text = option.text_content().strip()
-            option_texts.append(f"{i}. {text}")
-        return " | ".join(option_texts)
-    except:
-        return "选项获取失败"
+        items = page.evaluate(
+            """(xp) => {
+                const result = document.evaluate(
+                    xp, document, null, XPathResult.ORDERED_NODE_ITERATOR_TYPE, null
+                );
+                const items = [];
+                let node;
+                while ((node = result.iterateNext())) {
+                    items.push(node.textContent.trim());
+                }
+                return items;
+            }""",
+            xpath,
+        )
+    except PlaywrightError:
+        return 0, "选项获取失败"
+    return len(items), format_options(items)
+
+
+def apply_vacant_answer(page: Page, current, answer):
+    """将填空题答案填入输入框"""
+    page.fill(f"#q{current}", answer)
+
+
+def click_with_retry(locator, timeout=5000):
+    """点击定位器，失败时用更短的超时重试一次，仍失败则向上抛出"""
+    try:
+        locator.click(timeout=timeout)
+    except PlaywrightError:
+        locator.click(timeout=timeout // 2)
+
+
+def parse_choice(answer, option_count, default=1, minimum=1):
+    """把AI答案解析为合法的选项编号，非法时退回默认选项"""
+    try:
+        choice = int(answer)
+    except ValueError:
+        return default
+    if minimum <= choice <= option_count:
+        return choice
+    return default
+
+
+def apply_single_answer(page: Page, current, answer, option_count):
+    """将单选题答案点击到页面上"""
+    choice = parse_choice(answer, option_count)
+    options = page.locator(f"#div{current} > div.ui-controlgroup > div")
+    click_with_retry(options.nth(choice - 1))
+
+
+def apply_multiple_answer(page: Page, current, answer, option_count):
+    """将多选题答案点击到页面上"""
+    try:
+        choices = [int(x.strip()) for x in answer.split(",")]
+    except ValueError:
+        choices = [1]
+    options = page.locator(f"#div{current} > div.ui-controlgroup > div")
+    clicked = False
+    for choice in choices:
+        if 1 <= choice <= option_count:
+            click_with_retry(options.nth(choice - 1))
+            clicked = True
+    if not clicked:
+        click_with_retry(options.first)
+
+
+def apply_scale_answer(page: Page, current, answer, option_count):
+    """将量表题答案点击到页面上"""
+    choice = parse_choice(answer, option_count)
+    options = page.locator(f"#div{current} > div.scale-div > div > ul > li")
+    click_with_retry(options.nth(choice - 1))
+
+
+def apply_matrix_answer(page: Page, current, row, answer, option_count):
+    """将矩阵题某一行的答案点击到页面上（第1列是行标题，从第2列开始）"""
+    choice = parse_choice(answer, option_count, default=2, minimum=2)
+    cells = page.locator(f"#drv{current}_{row} > td")
+    click_with_retry(cells.nth(choice - 1))
+
+
+def apply_numeric_matrix_answer(page: Page, current, answer):
+    """将数字矩阵题答案填入各输入框"""
+    inputs = page.locator(f"#div{current} input[type='tel']")
+    input_count = inputs.count()
+    if not input_count:
+        logger.warning(f"第{current}题：未找到数字输入框")
+        return
+
+    try:
+        numbers = [
+            float(x.strip())
+            for x in answer.split(",")
+            if x.strip().replace(".", "").isdigit()
+        ]
+
+        numbers = [max(0, min(10, num)) for num in numbers]
+
+        while len(numbers) < input_count:
+            numbers.append(random.randint(1, 8))
+
+        numbers = numbers[:input_count]
+
+        for i in range(input_count):
+            value = (
+                int(numbers[i])
+                if numbers[i] == int(numbers[i])
+                else round(numbers[i], 1)
+            )
+            inputs.nth(i).fill(str(value))
+
+    except Exception as e:
+        logger.error(f"第{current}题数字输入解析失败: {e}")
+        for i in range(input_count):
+            inputs.nth(i).fill(str(random.randint(1, 8)))
 
 
 def vacant(page: Page, current, persona):
     question_text = get_question_text(page, current)
-    answer = ask_ai_for_answer(question_text, "", "text", persona)
-    page.fill(f"#q{current}", answer)
+    answer = ask_ai_for_answer_sync(question_text, "", "text", persona)
+    apply_vacant_answer(page, current, answer)
 
 
 def single(page: Page, current, persona):
     question_text = get_question_text(page, current)
     xpath = f'//*[@id="div{current}"]/div[2]/div'
-    options_text = get_options_text(page, xpath)
-
-    a = page.query_selector_all(xpath)
-    answer = ask_ai_for_answer(question_text, options_text, "single", persona)
+    option_count, options_text = fetch_options(page, xpath)
 
-    try:
-        choice = int(answer)
-        if 1 <= choice <= len(a):
-            page.click(f"#div{current} > div.ui-controlgroup > div:nth-child({choice})")
-        else:
-            page.click(f"#div{current} > div.ui-controlgroup > div:nth-child(1)")
-    except:
-        page.click(f"#div{current} > div.ui-controlgroup > div:nth-child(1)")
+    answer = ask_ai_for_answer_sync(question_text, options_text, "single", persona)
+    apply_single_answer(page, current, answer, option_count)
 
 
 def droplist(page: Page, current, persona):
     question_text = get_question_text(page, current)
 
     page.click(f"#select2-q{current}-container")
-    time.sleep(0.5)
+    try:
+        page.wait_for_selector(
+            f"#select2-q{current}-results li", state="visible", timeout=3000
+        )
+    except PlaywrightTimeoutError:
+        pass
 
-    options = page.query_selector_all(f"//*[@id='select2-q{current}-results']/li")
-    options_text = get_options_text(page, f"//*[@id='select2-q{current}-results']/li")
+    option_count, options_text = fetch_options(
+        page, f"//*[@id='select2-q{current}-results']/li"
+    )
 
-    answer = ask_ai_for_answer(question_text, options_text, "dropdown", persona)
+    answer = ask_ai_for_answer_sync(question_text, options_text, "dropdown", persona)
 
-    try:
-        choice = int(answer)
-        if 1 <= choice <= len(options):
-            page.click(f"//*[@id='select2-q{current}-results']/li[{choice}]")
-        else:
-            page.click(f"//*[@id='select2-q{current}-results']/li[1]")
-    except:
-        page.click(f"//*[@id='select2-q{current}-results']/li[1]")
+    choice = parse_choice(answer, option_count)
+    results = page.locator(f"#select2-q{current}-results li")
+    click_with_retry(results.nth(choice - 1))
 
 
 def multiple(page: Page, current, persona):
     question_text = get_question_text(page, current)
     xpath = f'//*[@id="div{current}"]/div[2]/div'
-    options_text = get_options_text(page, xpath)
-
-    options = page.query_selector_all(xpath)
-    answer = ask_ai_for_answer(question_text, options_text, "multiple", persona)
+    option_count, options_text = fetch_options(page, xpath)
 
-    try:
-        choices = [int(x.strip()) for x in answer.split(",")]
-        for choice in choices:
-            if 1 <= choice <= len(options):
-                css = f"#div{current} > div.ui-controlgroup > div:nth-child({choice})"
-                page.click(css)
-    except:
-        page.click(f"#div{current} > div.ui-controlgroup > div:nth-child(1)")
+    answer = ask_ai_for_answer_sync(question_text, options_text, "multiple", persona)
+    apply_multiple_answer(page, current, answer, option_count)
 
 
 def matrix(page: Page, current, persona):
     question_text = get_question_text(page, current)
-    xpath1 = f'//*[@id="divRefTab{current}"]/tbody/tr'
-    a = page.query_selector_all(xpath1)
-    q_num = 0
-    for tr in a:
-        if tr.get_attribute("rowindex") is not None:
-            q_num += 1
+
+    # 一次evaluate_all取回所有行标题，避免逐行往返
+    try:
+        row_titles = page.locator(
+            f"#divRefTab{current} > tbody > tr[rowindex] > td:first-child"
+        ).evaluate_all("tds => tds.map(td => td.textContent.trim())")
+    except PlaywrightError:
+        row_titles = []
 
     xpath2 = f'//*[@id="drv{current}_1"]/td'
-    b = page.query_selector_all(xpath2)
-    options_text = get_options_text(page, xpath2)
+    option_count, options_text = fetch_options(page, xpath2)
 
-    for i in range(1, q_num + 1):
-        try:
-            row_text = (
-                page.query_selector(f"#drv{current}_{i} td:first-child")
-                .text_content()
-                .strip()
-            )
-            sub_question = f"{question_text} - {row_text}"
-        except:
-            sub_question = f"{question_text} - 第{i}小题"
+    sub_questions = []
+    for i, row_title in enumerate(row_titles, 1):
+        if row_title:
+            sub_questions.append(f"{question_text} - {row_title}")
+        else:
+            sub_questions.append(f"{question_text} - 第{i}小题")
 
-        answer = ask_ai_for_answer(sub_question, options_text, "matrix", persona)
+    if not sub_questions:
+        return
 
-        try:
-            choice = int(answer)
-            if 2 <= choice <= len(b):
-                page.click(f"#drv{current}_{i} > td:nth-child({choice})")
-            else:
-                page.click(f"#drv{current}_{i} > td:nth-child(2)")
-        except:
-            page.click(f"#drv{current}_{i} > td:nth-child(2)")
+    # 先尝试整题一次调用：把所有行列出来要一个JSON整数数组
+    batch_question = question_text + "\n行列表：\n" + "\n".join(
+        f"{i}. {sub_question}" for i, sub_question in enumerate(sub_questions, 1)
+    )
+    cache_key = answer_cache_key(
+        persona, "matrix_batch", batch_question, options_text
+    )
+    choices = None
+    cached = get_cached_answer(cache_key)
+    if cached is not None:
+        choices = parse_matrix_batch(cached, len(sub_questions))
+    if choices is None:
+        # 回复是每行一个编号的JSON数组，token上限按行数给
+        answer = ask_ai_for_answer_sync(
+            batch_question,
+            options_text,
+            "matrix_batch",
+            persona,
+            max_tokens=8 * len(sub_questions) + 16,
+        )
+        choices = parse_matrix_batch(answer, len(sub_questions))
+        if choices is not None:
+            store_cached_answer(cache_key, answer)
+    if choices is not None:
+        for i, choice in enumerate(choices, 1):
+            apply_matrix_answer(page, current, i, choice, option_count)
+        return
+
+    # 解析失败时回退为并发逐行提问
+    logger.warning(f"第{current}题矩阵批量答案解析失败，回退到逐行提问")
+    answers = run_ai_tasks(
+        [
+            ask_ai_for_answer(sub_question, options_text, "matrix", persona)
+            for sub_question in sub_questions
+        ]
+    )
+    for i, answer in enumerate(answers, 1):
+        apply_matrix_answer(page, current, i, answer, option_count)
 
 
 def reorder(page: Page, current):
-    xpath = f'//*[@id="div{current}"]/ul/li'
-    a = page.query_selector_all(xpath)
-    for j in range(1, len(a) + 1):
-        b = random.randint(j, len(a))
-        page.click(f"#div{current} > ul > li:nth-child({b})")
+    items = page.locator(f"#div{current} > ul > li")
+    count = items.count()
+    for j in range(1, count + 1):
+        b = random.randint(j, count)
+        items.nth(b - 1).click()
         time.sleep(0.4)
 
 
 def scale(page: Page, current, persona):
     question_text = get_question_text(page, current)
     xpath = f'//*[@id="div{current}"]/div[2]/div/ul/li'
-    options_text = get_options_text(page, xpath)
+    option_count, options_text = fetch_options(page, xpath)
 
-    a = page.query_selector_all(xpath)
-    answer = ask_ai_for_answer(question_text, options_text, "scale", persona)
-
-    try:
-        choice = int(answer)
-        if 1 <= choice <= len(a):
-            page.click(
-                f"#div{current} > div.scale-div > div > ul > li:nth-child({choice})"
-            )
-        else:
-            page.click(f"#div{current} > div.scale-div > div > ul > li:nth-child(1)")
-    except:
-        page.click(f"#div{current} > div.scale-div > div > ul > li:nth-child(1)")
+    answer = ask_ai_for_answer_sync(question_text, options_text, "scale", persona)
+    apply_scale_answer(page, current, answer, option_count)
 
 
 def numeric_matrix(page: Page, current, persona):
     """处理数字输入矩阵题（type=10），如支出比例等"""
     question_text = get_question_text(page, current)
 
-    input_elements = page.query_selector_all(f"#div{current} input[type='tel']")
+    input_count = page.locator(f"#div{current} input[type='tel']").count()
 
-    if not input_elements:
+    if not input_count:
         logger.warning(f"第{current}题：未找到数字输入框")
         return
 
     try:
-        column_headers = page.query_selector_all(
+        column_info = page.locator(
             f"#div{current} .ui-table-column-title"
-        )
-        column_info = [header.text_content().strip() for header in column_headers]
+        ).evaluate_all("els => els.map(el => el.textContent.trim())")
         options_text = " | ".join(f"{i+1}. {col}" for i, col in enumerate(column_info))
-    except:
-        options_text = f"需要填入{len(input_elements)}个数字（0-10范围内）"
+    except PlaywrightError:
+        options_text = f"需要填入{input_count}个数字（0-10范围内）"
 
     full_question = f"{question_text}\n列选项: {options_text}\n请为每列分配一个0-10的数字，用逗号分隔"
-    answer = ask_ai_for_answer(full_question, options_text, "numeric_matrix", persona)
+    answer = ask_ai_for_answer_sync(full_question, options_text, "numeric_matrix", persona)
+    apply_numeric_matrix_answer(page, current, answer)
+
+
+def score_fill(page: Page, current, persona):
+    """评分题直接填入随机分数"""
+    page.fill(f"#q{current}", str(random.randint(1, 100)))
+
+
+# 题型代码到处理函数的映射，替代brush里的if/elif链
+HANDLERS: dict[str, Callable] = {
+    "1": vacant,
+    "2": vacant,
+    "3": single,
+    "4": multiple,
+    "5": scale,
+    "6": matrix,
+    "7": droplist,
+    "8": score_fill,
+    "10": numeric_matrix,
+    "11": lambda page, current, persona: reorder(page, current),
+}
+
+
+# 批量提问时的题型名称和答题格式说明
+QUESTION_TYPE_NAMES = {
+    "text": "填空题",
+    "single": "单选题",
+    "multiple": "多选题",
+    "scale": "量表题",
+    "matrix": "矩阵题行",
+    "numeric_matrix": "数字矩阵题",
+}
+
+
+# 一次evaluate抓取整页题目的类型、题干和选项文本
+_COLLECT_QUESTIONS_JS = """(ids) => ids.map(i => {
+    const div = document.getElementById('div' + i);
+    const type = div ? div.getAttribute('type') : null;
+    const topic = div ? div.querySelector('.topichtml') : null;
+    const grab = sel =>
+        Array.from(document.querySelectorAll(sel)).map(o => o.textContent.trim());
+    const info = {
+        id: i,
+        type: type,
+        text: topic ? topic.textContent.trim() : null,
+        options: [],
+        rows: [],
+        inputCount: 0,
+        columns: [],
+    };
+    if (type === '3' || type === '4') {
+        info.options = grab('#div' + i + ' > div.ui-controlgroup > div');
+    } else if (type === '5') {
+        info.options = grab('#div' + i + ' > div.scale-div > div > ul > li');
+    } else if (type === '6') {
+        info.rows = Array.from(
+            document.querySelectorAll('#divRefTab' + i + ' > tbody > tr')
+        )
+            .filter(tr => tr.getAttribute('rowindex') !== null)
+            .map(tr => {
+                const td = tr.querySelector('td:first-child');
+                return td ? td.textContent.trim() : '';
+            });
+        info.options = grab('#drv' + i + '_1 > td');
+    } else if (type === '10') {
+        info.inputCount =
+            document.querySelectorAll('#div' + i + " input[type='tel']").length;
+        info.columns = grab('#div' + i + ' .ui-table-column-title');
+    }
+    return info;
+})"""
+
+
+def format_options(option_texts):
+    """将选项文本列表格式化为 '1. xx | 2. yy' 形式"""
+    return " | ".join(f"{i}. {text}" for i, text in enumerate(option_texts, 1))
+
+
+def collect_questions(page: Page, start, count):
+    """收集当前页可批量提问的题目信息，整页一次evaluate抓取，矩阵题每行作为一条
+
+    返回 (questions, q_types)，q_types为题号到题型代码的映射，供brush分发使用。
+    """
+    ids = list(range(start + 1, start + count + 1))
+    if not ids:
+        return [], {}
+
+    infos = page.evaluate(_COLLECT_QUESTIONS_JS, ids)
+    questions = []
+    q_types = {}
+    for info in infos:
+        current = info["id"]
+        q_type = info.get("type")
+        q_types[current] = q_type
+        question_text = info.get("text") or f"第{current}题"
+
+        if q_type == "1" or q_type == "2":
+            questions.append(
+                {
+                    "current": current,
+                    "type": "text",
+                    "text": question_text,
+                    "options": "",
+                    "count": 0,
+                }
+            )
+        elif q_type == "3" or q_type == "4":
+            questions.append(
+                {
+                    "current": current,
+                    "type": "single" if q_type == "3" else "multiple",
+                    "text": question_text,
+                    "options": format_options(info["options"]),
+                    "count": len(info["options"]),
+                }
+            )
+        elif q_type == "5":
+            questions.append(
+                {
+                    "current": current,
+                    "type": "scale",
+                    "text": question_text,
+                    "options": format_options(info["options"]),
+                    "count": len(info["options"]),
+                }
+            )
+        elif q_type == "6":
+            options_text = format_options(info["options"])
+            for i, row_text in enumerate(info["rows"], 1):
+                sub_question = (
+                    f"{question_text} - {row_text}"
+                    if row_text
+                    else f"{question_text} - 第{i}小题"
+                )
+                questions.append(
+                    {
+                        "current": current,
+                        "type": "matrix",
+                        "row": i,
+                        "text": sub_question,
+                        "options": options_text,
+                        "count": len(info["options"]),
+                    }
+                )
+        elif q_type == "10":
+            if not info["inputCount"]:
+                continue
+            if info["columns"]:
+                options_text = format_options(info["columns"])
+            else:
+                options_text = f"需要填入{info['inputCount']}个数字（0-10范围内）"
+            questions.append(
+                {
+                    "current": current,
+                    "type": "numeric_matrix",
+                    "text": f"{question_text}\n列选项: {options_text}",
+                    "options": options_text,
+                    "count": info["inputCount"],
+                }
+            )
+
+    return questions, q_types
+
 
+def strip_code_fences(text):
+    """去掉AI回复外层的```json代码块标记"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*", "", text)
+        text = re.sub(r"\s*```$", "", text)
+    return text
+
+
+def parse_matrix_batch(answer, row_count):
+    """解析矩阵整题的JSON整数数组答案，行数不符或解析失败返回None"""
+    text = strip_code_fences(answer)
     try:
-        numbers = [
-            float(x.strip())
-            for x in answer.split(",")
-            if x.strip().replace(".", "").isdigit()
-        ]
+        data = json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        match = re.search(r"\[.*\]", text, re.DOTALL)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group(0))
+        except (json.JSONDecodeError, ValueError):
+            return None
 
-        numbers = [max(0, min(10, num)) for num in numbers]
+    if not isinstance(data, list) or len(data) != row_count:
+        return None
+    return [str(choice) for choice in data]
 
-        while len(numbers) < len(input_elements):
-            numbers.append(random.randint(1, 8))
 
-        numbers = numbers[: len(input_elements)]
+def parse_json_answers(text):
+    """解析AI返回的JSON答案数组，失败返回None"""
+    text = strip_code_fences(text)
+
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        match = re.search(r"\[.*\]", text, re.DOTALL)
+        if not match:
+            return None
+        try:
+            data = json.loads(match.group(0))
+        except (json.JSONDecodeError, ValueError):
+            return None
+
+    if not isinstance(data, list):
+        return None
+
+    answers = {}
+    for item in data:
+        if isinstance(item, dict) and "id" in item and "answer" in item:
+            try:
+                answers[int(item["id"])] = str(item["answer"]).strip()
+            except (ValueError, TypeError):
+                continue
+    return answers
+
+
+def ask_ai_for_page(questions, persona):
+    """将一页的所有题目合并为一次AI调用，返回带答案的题目列表，失败返回None"""
+    if not questions:
+        return []
+
+    lines = []
+    for n, q in enumerate(questions, 1):
+        line = f"{n}. 【{QUESTION_TYPE_NAMES[q['type']]}】{q['text']}"
+        if q["options"]:
+            line += f"\n选项：{q['options']}"
+        lines.append(line)
+
+    prompt = (
+        "请一次性回答问卷当前页的所有题目。\n"
+        "题目列表：\n" + "\n".join(lines) + "\n\n"
+        '请只返回一个JSON数组，每个元素形如 {"id": 题目序号, "answer": "答案"}。'
+        "答案格式：单选题/量表题/矩阵题行返回选项编号(如：1)；"
+        "多选题返回所选编号用逗号分隔(如：1,3,5)；"
+        "填空题返回不超过100字的简短真实回答，不要使用emoji表情；"
+        "数字矩阵题为每列分配一个0-10的整数（加起来等于10），用逗号分隔。"
+        "不要解释，不要输出JSON以外的内容。"
+    )
+
+    # 回复预算按各题型上限累加，每题再加一份JSON包装的开销
+    # （{"id": n, "answer": "..."}每个元素约10+个token）
+    page_max_tokens = sum(
+        MAX_TOKENS.get(q["type"], 150) + 16 for q in questions
+    )
+
+    max_retries = generation_params["max_retries"]
+    for attempt in range(max_retries):
+        try:
+            limiter.acquire(estimate_tokens(prompt, page_max_tokens))
+            raw_response = client.chat.completions.with_raw_response.create(
+                model=openai_config["model"],
+                messages=[
+                    {
+                        "role": "system",
+                        "content": answer_system_prompt(persona),
+                    },
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=generation_params["answer_temperature"],
+                max_tokens=page_max_tokens,
+                timeout=openai_config["timeout"],
+            )
+            limiter.update_from_headers(raw_response.headers)
+            response = raw_response.parse()
 
-        for i, input_elem in enumerate(input_elements):
-            input_id = input_elem.get_attribute("id")
-            if input_id:
-                value = (
-                    int(numbers[i])
-                    if numbers[i] == int(numbers[i])
-                    else round(numbers[i], 1)
+            content = clean_response(response.choices[0].message.content.strip())
+            answer_map = parse_json_answers(content)
+            if answer_map is None:
+                logger.warning(
+                    f"批量答案JSON解析失败，重试... (尝试 {attempt + 1}/{max_retries})"
                 )
-                page.fill(f"#{input_id}", str(value))
+                continue
 
-    except Exception as e:
-        logger.error(f"第{current}题数字输入解析失败: {e}")
-        for input_elem in input_elements:
-            input_id = input_elem.get_attribute("id")
-            if input_id:
-                random_value = random.randint(1, 8)
-                page.fill(f"#{input_id}", str(random_value))
+            answered = []
+            for n, q in enumerate(questions, 1):
+                if n not in answer_map or not answer_map[n]:
+                    logger.warning(f"批量答案缺少第{n}条，回退到逐题提问")
+                    return None
+                answered.append({**q, "answer": answer_map[n]})
+            return answered
+
+        except Exception as e:
+            logger.error(f"批量提问失败 (尝试 {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                time.sleep(generation_params["retry_delay"])
+
+    logger.warning("批量提问多次失败，回退到逐题提问")
+    return None
+
+
+def apply_answer(page: Page, question):
+    """把批量获取的答案应用到页面上"""
+    current = question["current"]
+    q_type = question["type"]
+    answer = question["answer"]
+
+    if q_type == "text":
+        apply_vacant_answer(page, current, answer)
+    elif q_type == "single":
+        apply_single_answer(page, current, answer, question["count"])
+    elif q_type == "multiple":
+        apply_multiple_answer(page, current, answer, question["count"])
+    elif q_type == "scale":
+        apply_scale_answer(page, current, answer, question["count"])
+    elif q_type == "matrix":
+        apply_matrix_answer(page, current, question["row"], answer, question["count"])
+    elif q_type == "numeric_matrix":
+        apply_numeric_matrix_answer(page, current, answer)
 
 
 def brush(page: Page):
-    persona = generate_persona()
+    # 从人设池抽取，省掉每份问卷一次的人设生成调用
+    persona = random.choice(PERSONAS) if PERSONAS else generate_persona()
+    logger.info(f"当前人设: {persona}")
 
     q_list = detect(page)
     current = 0
 
-    for j in q_list:
+    for page_index, j in enumerate(q_list, 1):
+        # 先收集整页题目，合并成一次AI调用；失败时回退到并发逐题提问
+        questions, q_types = collect_questions(page, current, j)
+        answered = ask_ai_for_page(questions, persona)
+        if answered is None and questions:
+            results = run_ai_tasks(
+                [
+                    ask_ai_for_answer(q["text"], q["options"], q["type"], persona)
+                    for q in questions
+                ]
+            )
+            answered = [
+                {**q, "answer": answer} for q, answer in zip(questions, results)
+            ]
+        answers = {}
+        for q in answered or []:
+            answers.setdefault(q["current"], []).append(q)
+
         for k in range(1, j + 1):
             current += 1
-            q_type = page.get_attribute(f"#div{current}", "type")
-
-            if q_type == "1" or q_type == "2":
-                vacant(page, current, persona)
-            elif q_type == "3":
-                single(page, current, persona)
-            elif q_type == "4":
-                multiple(page, current, persona)
-            elif q_type == "5":
-                scale(page, current, persona)
-            elif q_type == "6":
-                matrix(page, current, persona)
-            elif q_type == "7":
-                droplist(page, current, persona)
-            elif q_type == "8":
-                score = random.randint(1, 100)
-                page.fill(f"#q{current}", str(score))
-            elif q_type == "10":
-                numeric_matrix(page, current, persona)
-            elif q_type == "11":
-                reorder(page, current)
-            else:
-                logger.warning(f"第{k}题为不支持题型！题型代码：{q_type}")
+            q_type = q_types.get(current)
 
-            time.sleep(0.5)
+            if current in answers:
+                for q in answers[current]:
+                    apply_answer(page, q)
+            else:
+                handler = HANDLERS.get(q_type)
+                if handler is not None:
+                    handler(page, current, persona)
+                else:
+                    logger.warning(f"第{k}题为不支持题型！题型代码：{q_type}")
 
-        time.sleep(0.5)
+        # 点击本身会等待元素可交互，无需固定sleep；翻页后等下一页fieldset出现
         try:
             page.click("#divNext")
-            time.sleep(0.5)
-        except:
+            if page_index < len(q_list):
+                try:
+                    page.wait_for_selector(
+                        f"#fieldset{page_index + 1}", state="visible", timeout=3000
+                    )
+                except PlaywrightTimeoutError:
+                    pass
+        except PlaywrightError:
             page.click('//*[@id="ctlNext"]')
     submit(page)
 
@@ -620,13 +1373,13 @@ def submit(page: Page):
     try:
         page.click('//*[@id="layui-layer1"]/div[3]/a')
         time.sleep(submission_params["submit_button_delay"])
-    except:
+    except PlaywrightError:
         pass
 
     try:
         page.click('//*[@id="SM_BTN_1"]')
         time.sleep(submission_params["verification_delay"])
-    except:
+    except PlaywrightError:
         pass
 
     try:
@@ -644,100 +1397,70 @@ def submit(page: Page):
                         source_position={"x": 0, "y": 0},
                         target_position={"x": width, "y": 0},
                     )
-    except:
+    except PlaywrightError:
         pass
 
 
+# 提交完成的页面内信号：URL、完成提示元素、标题和正文文本，全部在一段JS里检查
+_COMPLETION_JS = """(origUrl) => {
+    const url = location.href;
+    if (url !== origUrl) {
+        return true;
+    }
+    const urlLower = url.toLowerCase();
+    const urlKeywords = ['complete', '完成', 'finish', 'success', 'thank', 'end', 'result'];
+    if (urlKeywords.some(keyword => urlLower.includes(keyword))) {
+        return true;
+    }
+    if (document.querySelector(
+        "[class*='success'], [class*='complete'], [class*='finish'], [id*='success'], [id*='complete'], [id*='finish']"
+    )) {
+        return true;
+    }
+    const title = document.title.toLowerCase();
+    const titleKeywords = ['完成', '成功', '感谢', 'complete', 'success', 'thank'];
+    if (titleKeywords.some(keyword => title.includes(keyword))) {
+        return true;
+    }
+    const text = document.body.innerText.toLowerCase();
+    const textKeywords = ['提交成功', '感谢您的参与', '问卷已提交', 'thank you', 'complete', 'success'];
+    return textKeywords.some(keyword => text.includes(keyword));
+}"""
+
+
 def wait_for_completion(
     page: Page, original_url: str, max_wait_time: int = None
 ) -> bool:
-    """超快速检测问卷提交完成"""
+    """等待问卷提交完成（事件驱动，取代30ms轮询）"""
     if max_wait_time is None:
         max_wait_time = submission_params["completion_wait_timeout"]
 
-    start_time = time.time()
-    check_interval = 0.03
+    deadline = time.time() + max_wait_time
 
-    try:
-        current_url = page.url
-        if current_url != original_url:
-            logger.info(f"页面已跳转: {current_url}")
-            return True
-    except:
-        pass
-
-    while time.time() - start_time < max_wait_time:
+    while True:
         try:
             current_url = page.url
-
             if current_url != original_url:
                 logger.info(f"检测到页面跳转: {current_url}")
                 return True
+        except PlaywrightError:
+            pass
 
-            url_lower = current_url.lower()
-            if any(
-                keyword in url_lower
-                for keyword in [
-                    "complete",
-                    "完成",
-                    "finish",
-                    "success",
-                    "thank",
-                    "end",
-                    "result",
-                ]
-            ):
-                logger.info(f"检测到完成页面: {current_url}")
-                return True
-
-            try:
-                success_indicators = page.query_selector_all(
-                    "[class*='success'], [class*='complete'], [class*='finish'], [id*='success'], [id*='complete'], [id*='finish']"
-                )
-                if success_indicators:
-                    logger.info("检测到完成提示元素")
-                    return True
-            except:
-                pass
-
-            try:
-                has_completion_text = page.evaluate(
-                    """
-                    () => {
-                        const text = document.body.innerText.toLowerCase();
-                        const keywords = ['提交成功', '感谢您的参与', '问卷已提交', 'thank you', 'complete', 'success'];
-                        return keywords.some(keyword => text.includes(keyword));
-                    }
-                """
-                )
-                if has_completion_text:
-                    logger.info("检测到完成文本内容")
-                    return True
-            except:
-                pass
-
-            try:
-                title = page.title().lower()
-                if any(
-                    keyword in title
-                    for keyword in [
-                        "完成",
-                        "成功",
-                        "感谢",
-                        "complete",
-                        "success",
-                        "thank",
-                    ]
-                ):
-                    logger.info(f"检测到完成页面标题: {page.title()}")
-                    return True
-            except:
-                pass
-
-            time.sleep(check_interval)
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
 
-        except Exception as e:
-            time.sleep(0.01)
+        try:
+            page.wait_for_function(
+                _COMPLETION_JS, arg=original_url, timeout=remaining * 1000
+            )
+            logger.info(f"检测到完成页面: {page.url}")
+            return True
+        except PlaywrightTimeoutError:
+            break
+        except Exception:
+            # 页面跳转会销毁执行上下文导致等待中断，回到循环顶部重查URL
+            time.sleep(0.05)
             continue
 
     try:
@@ -745,27 +1468,62 @@ def wait_for_completion(
         if final_url != original_url:
             logger.info(f"超时后检测到URL变化: {final_url}")
             return True
-    except:
+    except PlaywrightError:
         pass
 
     logger.warning(f"等待完成超时 ({max_wait_time}秒)")
     return False
 
 
-def run(xx, yy):
+def new_browser_context(browser: Browser):
+    """创建带视口、UA和代理配置的浏览器上下文"""
+    context_options = {
+        "viewport": {"width": 550, "height": 650},
+        "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36 Edg/138.0.0.0",
+    }
+
+    # 如果代理功能启用，添加代理配置
+    if proxy_config.get("enabled", False):
+        proxy_url = proxy_config.get("clash_proxy_url", "http://127.0.0.1:7897")
+        if proxy_url.startswith("http://"):
+            proxy_server = proxy_url.replace("http://", "")
+            context_options["proxy"] = {
+                "server": proxy_server,
+                "username": "",
+                "password": "",
+            }
+            logger.info(f"使用代理: {proxy_server}")
+
+    context = browser.new_context(**context_options)
+
+    # 拦截与填表无关的静态资源，加快页面加载（保留CSS，题型渲染依赖样式）
+    context.route(
+        "**/*",
+        lambda route: (
+            route.abort()
+            if route.request.resource_type in ("image", "font", "media")
+            else route.continue_()
+        ),
+    )
+
+    context.add_init_script(
+        """
+        Object.defineProperty(navigator, 'webdriver', {
+            get: () => undefined,
+        });
+    """
+    )
+
+    return context
+
+
+def run(ws_endpoint, xx, yy):
     global cur_num, cur_fail
 
     with sync_playwright() as p:
-        launch_options = {
-            "headless": False,
-            "args": [
-                "--disable-blink-features=AutomationControlled",
-                "--disable-web-security",
-                "--disable-features=VizDisplayCompositor",
-            ],
-        }
-
-        browser = p.chromium.launch(**launch_options)
+        # 连接主线程启动的共享浏览器进程，而不是每个线程各起一个Chromium
+        browser = p.chromium.connect(ws_endpoint)
+        context = None
 
         while cur_num < target_num:
             # 每次填写前切换代理节点
@@ -779,36 +1537,12 @@ def run(xx, yy):
                 else:
                     logger.warning("代理切换失败，继续使用当前代理")
 
-            # 配置浏览器代理
-            context_options = {
-                "viewport": {"width": 550, "height": 650},
-                "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36 Edg/138.0.0.0",
-            }
-
-            # 如果代理功能启用，添加代理配置
-            if proxy_config.get("enabled", False):
-                proxy_url = proxy_config.get("clash_proxy_url", "http://127.0.0.1:7897")
-                if proxy_url.startswith("http://"):
-                    proxy_server = proxy_url.replace("http://", "")
-                    context_options["proxy"] = {
-                        "server": proxy_server,
-                        "username": "",
-                        "password": "",
-                    }
-                    logger.info(f"使用代理: {proxy_server}")
-
-            context = browser.new_context(**context_options)
+            # 复用上下文：只有首次或上次异常后才重新创建
+            if context is None:
+                context = new_browser_context(browser)
 
             page = context.new_page()
 
-            page.add_init_script(
-                """
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined,
-                });
-            """
-            )
-
             try:
                 page.goto(url)
                 original_url = page.url
@@ -834,7 +1568,10 @@ def run(xx, yy):
                 else:
                     logger.warning("提交可能失败或超时")
 
-                context.close()
+                # 只关页面并清掉cookie，保留上下文给下一份问卷
+                page.close()
+                context.clear_cookies()
+                context.clear_permissions()
             except Exception as e:
                 traceback.print_exc()
                 lock.acquire()
@@ -848,13 +1585,19 @@ def run(xx, yy):
                     context.close()
                     browser.close()
                     quit()
+                # 异常后丢弃整个上下文，下一轮重建
                 context.close()
+                context = None
                 continue
 
+        if context is not None:
+            context.close()
         browser.close()
 
 
 if __name__ == "__main__":
+    init_runtime()
+
     logger.info("=== StarWenJuan自动填写工具 ===")
     logger.info(f"使用模型: {openai_config['model']}")
     logger.info(f"API地址: {openai_config['base_url']}")
@@ -899,6 +1642,8 @@ if __name__ == "__main__":
         logger.error("3. API密钥配置正确（如果需要）")
         exit()
 
+    PERSONAS = load_or_generate_personas()
+
     while True:
         url = input("请输入问卷链接: ").strip()
         if url:
@@ -935,7 +1680,7 @@ if __name__ == "__main__":
     logger.info(f"目标份数: {target_num}")
     logger.info(f"窗口数量: {num_threads}")
     logger.info("开始运行程序...")
-    logger.info("每次填写都会生成不同的人设...")
+    logger.info("每次填写都会从人设池抽取不同的人设...")
     if proxy_config.get("enabled", False) and proxy_config.get("auto_switch", True):
         logger.info("每次填写完成后会自动切换代理节点...")
 
@@ -945,14 +1690,27 @@ if __name__ == "__main__":
     lock = threading.Lock()
     threads: list[Thread] = []
 
-    for i in range(num_threads):
-        x = 50 + i * 60
-        y = 50
-        thread = Thread(target=run, args=(x, y))
-        threads.append(thread)
-        thread.start()
+    # 只启动一个共享的浏览器进程，各线程通过websocket连接各自建上下文
+    with sync_playwright() as p:
+        browser_server = p.chromium.launch_server(
+            headless=False,
+            args=[
+                "--disable-blink-features=AutomationControlled",
+                "--disable-web-security",
+                "--disable-features=VizDisplayCompositor",
+            ],
+        )
+
+        for i in range(num_threads):
+            x = 50 + i * 60
+            y = 50
+            thread = Thread(target=run, args=(browser_server.ws_endpoint, x, y))
+            threads.append(thread)
+            thread.start()
+
+        for thread in threads:
+            thread.join()
 
-    for thread in threads:
-        thread.join()
+        browser_server.close()
 
     logger.info("程序执行完成！")